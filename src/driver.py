@@ -7,13 +7,18 @@ It processes each line as a command according to a simple DSL,
 wherein each valid command will call to one of the library functions.
 Lines with invalid syntax or that otherwise result in errors log their error message. 
 
-See the README for more details on the DSL, or have a look at the `process_command` function.
+See the README for more details on the DSL, or have a look at the `_COMMANDS` table.
 """
 
+import dataclasses
+import enum
+import functools
+import io
+import itertools
 import logging
 import sys
 import typing
-from pprint import pprint
+from pprint import PrettyPrinter
 
 from tracker import datamodel as dm
 from tracker import datastore as ds
@@ -23,126 +28,351 @@ logging.basicConfig()
 logger = logging.getLogger("driver")
 
 
+BATCH_SIZE = 500
+"""Number of lines to process per transaction when reading commands from a file or pipe."""
+
+
 def main(command_file: typing.TextIO, output_file: typing.TextIO) -> None:
     """Reads commands from `command_file` and processes them, writing to `output_file` as needed.
 
     This is called by default when this script is executed without arguments.
     In that case, `command_file` is `sys.stdin` and `output_file` is `sys.stdout`.
+
+    When used interactively, each command is committed as soon as it's processed.
+    Otherwise, commands are committed in batches of `BATCH_SIZE` lines,
+    each using a savepoint so that a failed command only rolls back its own changes;
+    read-only commands skip the savepoint and just use the batch's transaction.
     """
 
     store = ds.DataStore()
+    lines = enumerate(map(str.strip, command_file))
     with store.session() as session:
-        for line_num, line in enumerate(map(lambda line: line.strip(), command_file)):
-            process_one(session, line_num, line, output_file)
+        if command_file.isatty():
+            for line_num, line in lines:
+                process_one(
+                    session.transaction, session.transaction, line_num, line, output_file
+                )
+            return
+
+        while batch := list(itertools.islice(lines, BATCH_SIZE)):
+            with session.transaction():
+                for line_num, line in batch:
+                    process_one(
+                        session.savepoint, session.current, line_num, line, output_file
+                    )
 
 
 def process_one(
-    session: ds.DataSession, line_num: int, line: str, output_file: typing.TextIO
+    begin: typing.Callable[[], typing.ContextManager[ds.DataTransaction]],
+    begin_read: typing.Callable[[], typing.ContextManager[ds.DataTransaction]],
+    line_num: int,
+    line: str,
+    output_file: typing.TextIO,
 ) -> None:
-    """Process a single line. This is split out to reduce nesting."""
+    """Process a single line within a new transaction (or savepoint) from `begin`.
+
+    Read-only commands use `begin_read` instead, which may reuse the current transaction.
+    This is split out to reduce nesting.
+    Comments and empty lines are skipped without starting a transaction.
+    """
+    if _is_blank_or_comment(line):
+        return
+
+    if line.split(maxsplit=1)[0] in _READ_VERBS:
+        begin = begin_read
+
     try:
-        with session.transaction() as transaction:
+        with begin() as transaction:
             process_command(transaction, line, output_file)
     except (errors.TrackerError, ValueError) as err:
-        logger.error(f"Command on line {line_num} failed: {err}\n\t> {line}\n")
-
-
-# These helpers associate command strings to item types.
-_devices: dict[str, type[dm.Device]] = {
-    "SWITCH": dm.Switch,
-    "DIMMER": dm.Dimmer,
-    "LOCK": dm.Lock,
-    "THERMOSTAT": dm.Thermostat,
-}
-_dev_or_place = typing.cast(
-    dict[str, type[ds.PlaceOrDevice]], _devices | {"DWELLING": dm.Dwelling, "HUB": dm.Hub}
+        logger.error("Command on line %d failed: %s\n\t> %s\n", line_num, err, line)
+
+
+def _is_blank_or_comment(line: str) -> bool:
+    """Whether a stripped line is empty or its first word is `#`, without splitting it."""
+
+    return not line or (line[0] == "#" and (len(line) == 1 or line[1].isspace()))
+
+
+class Kind(typing.NamedTuple):
+    """An item type, as it's named in commands."""
+
+    word: str
+    plural: str
+    cls: type[ds.PlaceOrDevice]
+    role: typing.Literal["place", "device", "all devices"]
+
+
+_KINDS = (
+    Kind("DWELLING", "DWELLINGS", dm.Dwelling, "place"),
+    Kind("HUB", "HUBS", dm.Hub, "place"),
+    Kind("SWITCH", "SWITCHES", dm.Switch, "device"),
+    Kind("DIMMER", "DIMMERS", dm.Dimmer, "device"),
+    Kind("LOCK", "LOCKS", dm.Lock, "device"),
+    Kind("THERMOSTAT", "THERMOSTATS", dm.Thermostat, "device"),
+    Kind("DEVICE", "DEVICES", dm.Device, "all devices"),
 )
-_all_kinds = _dev_or_place | {"DEVICE": dm.Device}
-_plural_kinds = {f"{k}S": v for k, v in _all_kinds.items() if k != "SWITCH"} | {
-    "SWITCHES": dm.Switch
-}
+
+
+# A command pattern is matched word-by-word against a split command line:
+# a `str` must match exactly, `_ARG` matches any word, `_INT` matches any integer,
+# and a `dict` matches any of its keys, standing in for the corresponding value.
+# Every `_ARG` word, `_INT` value, or `dict` value is passed, in order,
+# to the command's handler, which is called as `handler(transaction, output_file, *args)`.
+_ARG = None
+_INT = int
+Pattern: typing.TypeAlias = tuple[str | dict[str, typing.Any] | type[int] | None, ...]
+Handler: typing.TypeAlias = typing.Callable[..., object]
+
+
+EnumT = typing.TypeVar("EnumT", bound=enum.Enum)
+
+
+def _words(enum_cls: type[EnumT]) -> dict[str, EnumT]:
+    """Map the members of an `Enum` from their values in upper case, as written in commands."""
+
+    return {member.value.upper(): member for member in enum_cls}
+
+
+class Command(typing.NamedTuple):
+    """Associates a command pattern with the handler that carries it out."""
+
+    pattern: Pattern
+    handler: Handler
+
+
+def _show_one(
+    dt: ds.DataTransaction,
+    output_file: typing.TextIO,
+    name: str,
+    *,
+    kind: str,
+    cls: type[ds.PlaceOrDevice],
+    depth: int,
+) -> None:
+    """Handle `SHOW {ITEM} name` and `DETAIL {ITEM} name`."""
+
+    output_file.write(f"--{kind} '{name}'--\n")
+    show([dt.get_by_name(cls, name, "detail")], output_file, depth=depth)
+
+
+def _show_all(
+    dt: ds.DataTransaction,
+    output_file: typing.TextIO,
+    kind: str,
+    items: typing.Iterable[typing.Any],
+) -> None:
+    """Handle `DETAIL {ITEM}S` and `LIST {ITEM}S`."""
+
+    output_file.write(f"--All {kind}--\n")
+    show(items, output_file)
+
+
+# fmt: off
+_COMMANDS: list[Command] = [
+    Command(("NEW", "DWELLING", _ARG),
+            lambda dt, out, name: dt.new_dwelling(name)),
+    Command(("SET", "DWELLING", _ARG, "TO", _words(dm.OccupancyState)),
+            lambda dt, out, name, state: dt.set_dwelling_occupancy(name, state)),
+
+    Command(("NEW", "HUB", _ARG),
+            lambda dt, out, name: dt.new_hub(name)),
+    Command(("INSTALL", _ARG, "INTO", _ARG),
+            lambda dt, out, hub_name, dwelling_name: dt.install_hub(hub_name, dwelling_name)),
+    Command(("UNINSTALL", _ARG),
+            lambda dt, out, hub_name: dt.uninstall_hub(hub_name)),
+
+    Command(("NEW", "SWITCH", _ARG),
+            lambda dt, out, name: dt.new_switch(name)),
+    Command(("SET", "SWITCH", _ARG, "TO", _words(dm.SwitchState)),
+            lambda dt, out, name, state: dt.set_switch_state(name, state)),
+
+    Command(("NEW", "DIMMER", _ARG, "RANGE", _INT, "TO", _INT, "WITH", "FACTOR", _INT),
+            lambda dt, out, name, low, high, factor: dt.new_dimmer(name, low, high, factor)),
+    Command(("MODIFY", "DIMMER", _ARG, "RANGE", _INT, "TO", _INT, "WITH", "FACTOR", _INT),
+            lambda dt, out, name, low, high, factor: dt.update_dimmer(
+                name, low, high, factor)),
+    Command(("SET", "DIMMER", _ARG, "TO", _INT),
+            lambda dt, out, name, value: dt.set_dimmer_value(name, value)),
+
+    Command(("NEW", "LOCK", _ARG, "WITH", "PIN", _ARG),
+            lambda dt, out, name, pin: dt.new_lock(name, pin)),
+    Command(("MODIFY", "LOCK", _ARG, "ADD", "PIN", _ARG),
+            lambda dt, out, name, pin: dt.add_lock_pin(name, pin)),
+    Command(("MODIFY", "LOCK", _ARG, "REMOVE", "PIN", _ARG),
+            lambda dt, out, name, pin: dt.remove_lock_pin(name, pin)),
+    Command(("SET", "LOCK", _ARG, "TO", "LOCKED"),
+            lambda dt, out, name: dt.lock_door(name)),
+    Command(("SET", "LOCK", _ARG, "TO", "UNLOCKED", "USING", _ARG),
+            lambda dt, out, name, pin: dt.unlock_door(name, pin)),
+
+    Command(("NEW", "THERMOSTAT", _ARG, "WITH", "DISPLAY", "IN", _words(dm.ThermoDisplay)),
+            lambda dt, out, name, display: dt.new_thermostat(name, display)),
+    Command(("MODIFY", "THERMOSTAT", _ARG, "WITH", "DISPLAY", "IN", _words(dm.ThermoDisplay)),
+            lambda dt, out, name, display: dt.update_thermostat(name, display)),
+    Command(("SET", "THERMOSTAT", _ARG, "TO", _words(dm.ThermoMode)),
+            lambda dt, out, name, mode: dt.set_thermo_mode(name, mode)),
+    Command(("SET", "THERMOSTAT", _ARG, "TARGET", "TO", _INT, "TO", _INT),
+            lambda dt, out, name, low, high: dt.set_thermo_set_points(name, low, high)),
+    Command(("SET", "THERMOSTAT", _ARG, "CURRENT", "TO", _INT),
+            lambda dt, out, name, current: dt.set_thermo_current_temp(name, current)),
+]
+# fmt: on
+
+# These commands are generated for each kind of item they accept.
+_COMMANDS += [
+    Command(
+        ("PAIR", kind.word, _ARG, "WITH", _ARG),
+        lambda dt, out, device_name, hub_name, cls=kind.cls: dt.pair_device(
+            cls, device_name, hub_name
+        ),
+    )
+    for kind in _KINDS
+    if kind.role == "device"
+]
+_COMMANDS += [
+    Command(
+        ("UNPAIR", kind.word, _ARG),
+        lambda dt, out, device_name, cls=kind.cls: dt.unpair_device(cls, device_name),
+    )
+    for kind in _KINDS
+    if kind.role == "device"
+]
+_COMMANDS += [
+    Command(
+        ("RENAME", kind.word, _ARG, "TO", _ARG),
+        lambda dt, out, old_name, new_name, cls=kind.cls: dt.rename(cls, old_name, new_name),
+    )
+    for kind in _KINDS
+    if kind.role != "all devices"
+]
+_COMMANDS += [
+    Command(
+        ("DELETE", kind.word, _ARG),
+        lambda dt, out, name, cls=kind.cls: dt.delete(cls, name),
+    )
+    for kind in _KINDS
+    if kind.role != "all devices"
+]
+_COMMANDS += [
+    Command(
+        ("SHOW", kind.word, _ARG),
+        functools.partial(_show_one, kind=kind.word, cls=kind.cls, depth=1),
+    )
+    for kind in _KINDS
+]
+_COMMANDS += [
+    Command(
+        ("DETAIL", kind.word, _ARG),
+        functools.partial(_show_one, kind=kind.word, cls=kind.cls, depth=2),
+    )
+    for kind in _KINDS
+]
+_COMMANDS += [
+    Command(
+        ("DETAIL", kind.plural),
+        lambda dt, out, plural=kind.plural, cls=kind.cls: _show_all(
+            dt, out, plural, dt.get_all(cls)
+        ),
+    )
+    for kind in _KINDS
+]
+_COMMANDS += [
+    Command(
+        ("LIST", kind.plural),
+        lambda dt, out, plural=kind.plural, cls=kind.cls: _show_all(
+            dt, out, plural, dt.get_all_names(cls)
+        ),
+    )
+    for kind in _KINDS
+]
+
+
+def _dispatch_key(pattern: Pattern) -> tuple[str, ...]:
+    """Return the leading literal words of a pattern (at most two) used to look it up."""
+
+    key = []
+    for word in pattern[:2]:
+        if not isinstance(word, str):
+            break
+        key.append(word)
+    return tuple(key)
+
+
+# Commands are grouped by their leading literal words,
+# e.g. `("NEW", "DWELLING")` or `("INSTALL",)`,
+# so a line is only compared against the few patterns that share its prefix.
+_DISPATCH: dict[tuple[str, ...], list[Command]] = {}
+for _command in _COMMANDS:
+    _DISPATCH.setdefault(_dispatch_key(_command.pattern), []).append(_command)
+
+_VERBS = frozenset(key[0] for key in _DISPATCH)
+_READ_VERBS = frozenset({"SHOW", "DETAIL", "LIST"})
+
+
+def _match(pattern: Pattern, words: list[str]) -> list[typing.Any] | None:
+    """Return the arguments if the `words` match the `pattern`; otherwise, return `None`."""
+
+    if len(pattern) != len(words):
+        return None
+
+    # Integers are only converted once the whole pattern matches,
+    # so a line that doesn't match reports bad syntax, rather than a bad number.
+    args: list[typing.Any] = []
+    int_positions = []
+    for expected, word in zip(pattern, words):
+        if expected is _ARG:
+            args.append(word)
+        elif expected is _INT:
+            int_positions.append(len(args))
+            args.append(word)
+        elif isinstance(expected, dict):
+            if word not in expected:
+                return None
+            args.append(expected[word])
+        elif expected != word:
+            return None
+
+    for i in int_positions:
+        args[i] = int(args[i])
+    return args
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse(command: str) -> tuple[Handler, tuple[typing.Any, ...]] | None:
+    """Find the handler and arguments for a command, or `None` if there's nothing to do.
+
+    This only depends on the command text, so results are cached;
+    scripts often repeat the same commands, e.g. when toggling a switch.
+    """
+
+    words = command.split()
+    if not words or words[0] == "#":  # Skip comments and empty lines.
+        return None
+
+    if words[0] not in _VERBS:
+        raise errors.TrackerError("unknown command or bad syntax")
+
+    candidates = _DISPATCH.get(tuple(words[:2])) or _DISPATCH.get(tuple(words[:1]), [])
+    for pattern, handler in candidates:
+        if (args := _match(pattern, words)) is not None:
+            return handler, tuple(args)
+
+    raise errors.TrackerError("unknown command or bad syntax")
 
 
 def process_command(dt: ds.DataTransaction, command: str, output_file: typing.TextIO) -> None:
-    """Process a command, possibly writing text to the `output_file`."""
+    """Process a command, possibly writing text to the `output_file`.
 
-    match command.split():
-        case ["#", *_] | []:  # Skip comments and empty lines.
-            return
+    Output is collected and written all at once after the command succeeds.
+    """
 
-        case ["NEW", "DWELLING", name]:
-            dt.new_dwelling(name)
-        case ["SET", "DWELLING", name, "TO", ("OCCUPIED" | "VACANT") as state]:
-            dt.set_dwelling_occupancy(name, dm.OccupancyState(state.lower()))
-
-        case ["NEW", "HUB", name]:
-            dt.new_hub(name)
-        case ["INSTALL", hub_name, "INTO", dwelling_name]:
-            dt.install_hub(hub_name, dwelling_name)
-        case ["UNINSTALL", hub_name]:
-            dt.uninstall_hub(hub_name)
-
-        case ["PAIR", dev_kind, device_name, "WITH", hub_name] if (
-            dcls := _devices.get(dev_kind)
-        ):
-            dt.pair_device(dcls, device_name, hub_name)
-        case ["UNPAIR", dev_kind, device_name] if (dcls := _devices.get(dev_kind)):
-            dt.unpair_device(dcls, device_name)
-
-        case ["NEW", "SWITCH", name]:
-            dt.new_switch(name)
-        case ["SET", "SWITCH", name, "TO", ("ON" | "OFF") as state]:
-            dt.set_switch_state(name, dm.SwitchState(state.lower()))
-
-        case ["NEW", "DIMMER", name, "RANGE", low, "TO", high, "WITH", "FACTOR", factor]:
-            dt.new_dimmer(name, int(low), int(high), int(factor))
-        case ["MODIFY", "DIMMER", name, "RANGE", low, "TO", high, "WITH", "FACTOR", factor]:
-            dt.update_dimmer(name, int(low), int(high), int(factor))
-        case ["SET", "DIMMER", name, "TO", value]:
-            dt.set_dimmer_value(name, int(value))
-
-        case ["NEW", "LOCK", name, "WITH", "PIN", pin]:
-            dt.new_lock(name, pin)
-        case ["MODIFY", "LOCK", name, "ADD", "PIN", pin]:
-            dt.add_lock_pin(name, pin)
-        case ["MODIFY", "LOCK", name, "REMOVE", "PIN", pin]:
-            dt.remove_lock_pin(name, pin)
-        case ["SET", "LOCK", name, "TO", "LOCKED"]:
-            dt.lock_door(name)
-        case ["SET", "LOCK", name, "TO", "UNLOCKED", "USING", pin]:
-            dt.unlock_door(name, pin)
-
-        case ["NEW", "THERMOSTAT", name, "WITH", "DISPLAY", "IN", ("C" | "F") as display]:
-            dt.new_thermostat(name, dm.ThermoDisplay(display.lower()))
-        case ["MODIFY", "THERMOSTAT", name, "WITH", "DISPLAY", "IN", ("C" | "F") as display]:
-            dt.update_thermostat(name, dm.ThermoDisplay(display.lower()))
-        case ["SET", "THERMOSTAT", name, "TO", ("OFF" | "HEAT" | "COOL" | "HEATCOOL") as mode]:
-            dt.set_thermo_mode(name, dm.ThermoMode(mode.lower()))
-        case ["SET", "THERMOSTAT", name, "TARGET", "TO", low, "TO", high]:
-            dt.set_thermo_set_points(name, int(low), int(high))
-        case ["SET", "THERMOSTAT", name, "CURRENT", "TO", current]:
-            dt.set_thermo_current_temp(name, int(current))
-
-        case ["RENAME", kind, old_name, "TO", new_name] if (devp := _dev_or_place.get(kind)):
-            dt.rename(devp, old_name, new_name)
-        case ["DELETE", kind, name] if (devp := _dev_or_place.get(kind)):
-            dt.delete(devp, name)
-
-        case ["SHOW", kind, name] if (cls := _all_kinds.get(kind)):
-            output_file.write(f"--{kind} '{name}'--\n")
-            show([dt.get_by_name(cls, name, "detail")], output_file, depth=1)
-        case ["DETAIL", kind, name] if (cls := _all_kinds.get(kind)):
-            output_file.write(f"--{kind} '{name}'--\n")
-            show([dt.get_by_name(cls, name, "detail")], output_file)
-        case ["DETAIL", kind] if (cls := _plural_kinds.get(kind)):
-            output_file.write(f"--All {kind}--\n")
-            show(dt.get_all(cls), output_file)
-        case ["LIST", kind] if (cls := _plural_kinds.get(kind)):
-            output_file.write(f"--All {kind}--\n")
-            show(dt.get_all_names(cls), output_file)
-
-        case _:
-            raise errors.TrackerError("unknown command or bad syntax")
+    if (parsed := _parse(command)) is not None:
+        handler, args = parsed
+        buffer = io.StringIO()
+        handler(dt, buffer, *args)
+        if output := buffer.getvalue():
+            output_file.write(output)
 
 
 def show(
@@ -150,10 +380,95 @@ def show(
 ) -> None:
     """Pretty-print information selected items to `output_file`."""
 
+    printer = _Printer(stream=output_file, sort_dicts=False, width=_WIDTH, depth=depth)
     for d in items:
-        pprint(d, stream=output_file, sort_dicts=False, width=100, depth=depth)
+        printer.pprint(d)
     output_file.write("\n")
 
 
+_WIDTH = 100
+
+
+class _Printer(PrettyPrinter):
+    """A `PrettyPrinter` that avoids rendering entire object graphs only to measure them.
+
+    To decide whether an item fits on one line, `PrettyPrinter` first formats it in full.
+    For mapped classes, that means following every relationship,
+    e.g., a `Switch` includes its `Hub`, which includes every other `Device` paired with it.
+    Instead, this stops once the text is too wide to fit on a line,
+    in which case the printer splits the item's fields across lines,
+    so the partial text is never written.
+    """
+
+    def format(
+        self, object: object, context: dict[int, int], maxlevels: int, level: int
+    ) -> tuple[str, bool, bool]:
+        if isinstance(object, dm.BaseModel):
+            rep = _BoundedRepr(_WIDTH)(object)
+            return rep, not rep.startswith("<"), False
+        return super().format(object, context, maxlevels, level)
+
+
+class _TooWide(Exception):
+    pass
+
+
+class _BoundedRepr:
+    """Builds the dataclass `repr` of a mapped object, giving up after `limit` characters."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.parts: list[str] = []
+        self.size = 0
+        self.active: set[int] = set()
+
+    def __call__(self, obj: dm.BaseModel) -> str:
+        try:
+            self._write_model(obj)
+        except _TooWide:
+            pass
+        return "".join(self.parts)
+
+    def _write(self, text: str) -> None:
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size > self.limit:
+            raise _TooWide
+
+    def _write_model(self, obj: dm.BaseModel) -> None:
+        # Like the dataclass `__repr__`, show recursive references as "...".
+        if id(obj) in self.active:
+            self._write("...")
+            return
+
+        self.active.add(id(obj))
+        self._write(f"{type(obj).__qualname__}(")
+        for i, name in enumerate(_repr_fields(type(obj))):
+            self._write(f"{', ' if i else ''}{name}=")
+            self._write_value(getattr(obj, name))
+        self._write(")")
+        self.active.remove(id(obj))
+
+    def _write_value(self, value: object) -> None:
+        if isinstance(value, dm.BaseModel):
+            self._write_model(value)
+        elif isinstance(value, list) and type(value).__repr__ is list.__repr__:
+            self._write("[")
+            for i, item in enumerate(value):
+                if i:
+                    self._write(", ")
+                self._write_value(item)
+            self._write("]")
+        else:
+            self._write(repr(value))
+
+
+@functools.cache
+def _repr_fields(cls: type[dm.BaseModel]) -> tuple[str, ...]:
+    """Names of the fields included in the dataclass `repr` of a mapped class."""
+
+    return tuple(f.name for f in dataclasses.fields(cls) if f.repr)
+
+
 if __name__ == "__main__":
     main(sys.stdin, sys.stdout)
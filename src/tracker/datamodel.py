@@ -4,11 +4,12 @@ This module defines the types used by this service and the relationships among t
 
 from __future__ import annotations
 
+import functools
 import re
 import typing
 from datetime import datetime
 from enum import Enum
-from typing import Annotated, Any, Iterable, Protocol, Self
+from typing import Annotated, Any, Protocol
 
 import sqlalchemy
 from sqlalchemy import (
@@ -42,8 +43,14 @@ CentiCelsius = Annotated[int, mapped_column(Integer)]
 """1/100 of a degree Celsius."""
 
 
-class BaseModel(MappedAsDataclass, DeclarativeBase):
-    """Base class used to map between Python classes and database tables."""
+class BaseModel(MappedAsDataclass, DeclarativeBase, eq=False):
+    """Base class used to map between Python classes and database tables.
+
+    Mapped classes are dataclasses, giving them a convenient `__init__` and `__repr__`,
+    but they use identity equality (and hashing) rather than the dataclass `__eq__`.
+    Within a session, the identity map guarantees one object per row,
+    and comparing field-by-field would load every relationship on each comparison.
+    """
 
     metadata = MetaData(
         naming_convention={
@@ -55,21 +62,22 @@ class BaseModel(MappedAsDataclass, DeclarativeBase):
         }
     )
 
-    @declared_attr.directive
-    def __tablename__(cls: Self) -> str:
-        """Use snake_case names for tables."""
-        return "_".join(p.lower() for p in _split_camel(cls.__name__))
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        """Use snake_case names for tables, unless a subclass sets its own `__tablename__`."""
+        if "__tablename__" not in cls.__dict__:
+            cls.__tablename__ = _table_name(cls.__name__)
+        super().__init_subclass__(**kwargs)
 
 
-def _split_camel(s: str) -> Iterable[str]:
-    """Yield substrings at transitions from non-uppercase ASCII to uppercase ASCII."""
+@functools.cache
+def _table_name(class_name: str) -> str:
+    """Convert a CamelCase class name to a snake_case table name."""
 
-    prev = 0
-    for m in re.finditer(r"[^A-Z][A-Z]", s):
-        e = m.span()[1] - 1
-        yield s[prev:e]
-        prev = e
-    yield s[prev:]
+    return _CAMEL_RE.sub("_", class_name).lower()
+
+
+_CAMEL_RE = re.compile(r"(?<=[^A-Z])(?=[A-Z])")
+"""Matches transitions from non-uppercase ASCII to uppercase ASCII."""
 
 
 class AutoID(MappedAsDataclass):
@@ -88,6 +96,10 @@ class DeviceKind(Enum):
     Thermostat = "thermostat"
 
 
+_KIND_BY_CLASS_NAME = {kind.value: kind for kind in DeviceKind}
+"""Maps lowercase `Device` subclass names to their `DeviceKind`."""
+
+
 class OccupancyState(Enum):
     """States of a Dwelling's occupancy."""
 
@@ -163,7 +175,7 @@ class Hub(AutoID, Hardware, BaseModel):
 
     # A Hub is associated with a Dwelling.
     dwelling_id: Mapped[DbID | None] = mapped_column(
-        ForeignKey("dwelling.id"), nullable=True, init=False
+        ForeignKey("dwelling.id"), nullable=True, index=True, init=False
     )
     dwelling: Mapped[Dwelling | None] = relationship(
         lambda: Dwelling, back_populates="hubs", default=None
@@ -208,8 +220,8 @@ class DeviceID(MappedAsDataclass):
             }
 
         try:
-            return {"polymorphic_identity": DeviceKind(cls.__name__.lower())}
-        except ValueError:
+            return {"polymorphic_identity": _KIND_BY_CLASS_NAME[cls.__name__.lower()]}
+        except KeyError:
             raise TypeError(f"Device {cls.__name__.lower()} is not a declared DeviceKind")
 
 
@@ -219,7 +231,7 @@ class Device(DeviceID, Hardware, BaseModel):
     kind: Mapped[DeviceKind] = mapped_column(init=False)
     name: Mapped[str] = mapped_column()
     hub_id: Mapped[DbID | None] = mapped_column(
-        ForeignKey("hub.id"), nullable=True, init=False
+        ForeignKey("hub.id"), nullable=True, index=True, init=False
     )
     hub: Mapped[Hub | None] = relationship(
         Hub, back_populates="devices", default=None, kw_only=True
@@ -284,7 +296,19 @@ class LockPin(BaseModel):
     lock: Mapped[Lock] = relationship(Lock, back_populates="lock_pins", init=False)
 
     __table_args__ = (
-        CheckConstraint("pin REGEXP '^[0-9]{4,}$'", name="pin_is_four_or_more_digits"),
+        # LIKE/GLOB are built into SQLite, whereas REGEXP calls back into Python for every row.
+        CheckConstraint(
+            "length(pin) >= 4 AND pin NOT GLOB '*[^0-9]*'", name="pin_is_four_or_more_digits"
+        ),
+    )
+
+
+def _display_temp(display: Mapped[ThermoDisplay], centi_c: Mapped[CentiCelsius]) -> Any:
+    """SQL expression converting `centi_c` to degrees in the `display` unit."""
+
+    return case(
+        (display == ThermoDisplay.Celsius.name, centi_c / 100.0),
+        else_=(9 * centi_c / 500.0 + 32.0),  # C to F: (temp/100.0) * (9/5) + 32.0
     )
 
 
@@ -299,23 +323,15 @@ class Thermostat(Device):
     current_centi_c: Mapped[CentiCelsius] = mapped_column(default=2220)
     target_centi_c: Mapped[CentiCelsius] = mapped_column(default=2220)
 
+    # These are only needed for display, so they're loaded together on first access.
     display_low: Mapped[float] = column_property(
-        case(
-            (display == ThermoDisplay.Celsius.name, low_centi_c / 100.0),
-            else_=(9 * low_centi_c / 500.0 + 32.0),  # C to F: (temp/100.0) * (9/5) + 32.0
-        )
+        _display_temp(display, low_centi_c), deferred=True, group="display"
     )
     display_high: Mapped[float] = column_property(
-        case(
-            (display == ThermoDisplay.Celsius.name, high_centi_c / 100.0),
-            else_=(9 * high_centi_c / 500.0 + 32.0),
-        )
+        _display_temp(display, high_centi_c), deferred=True, group="display"
     )
     display_current: Mapped[float] = column_property(
-        case(
-            (display == ThermoDisplay.Celsius.name, current_centi_c / 100.0),
-            else_=(9 * current_centi_c / 500.0 + 32.0),
-        )
+        _display_temp(display, current_centi_c), deferred=True, group="display"
     )
 
 
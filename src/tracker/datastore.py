@@ -5,12 +5,27 @@ This module defines functions to manipulate data this project manages.
 from __future__ import annotations
 
 import contextlib
-import uuid
-from typing import Iterator, TypeAlias, TypeVar
+import secrets
+import weakref
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator, TypeAlias, TypeVar
 
 import sqlalchemy.exc
-from sqlalchemy import Engine, StaticPool, create_engine, engine, event, select
-from sqlalchemy.orm import Session
+import sqlalchemy.orm.exc
+from sqlalchemy import (
+    Engine,
+    Pool,
+    Select,
+    StaticPool,
+    bindparam,
+    create_engine,
+    engine,
+    event,
+    insert,
+    select,
+)
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import Session, SessionTransaction, undefer_group
 
 from . import errors
 from .datamodel import (
@@ -21,6 +36,7 @@ from .datamodel import (
     Dwelling,
     Hub,
     Lock,
+    LockPin,
     LockState,
     OccupancyState,
     Switch,
@@ -31,29 +47,57 @@ from .datamodel import (
     Thermostat,
 )
 
+_YIELD_PER = 1000
+"""How many rows `get_all` and `get_all_names` fetch from the database at a time."""
+
+_THERMO_OPERATIONS = {
+    (ThermoMode.Cool, 1): ThermoOperation.Cooling,
+    (ThermoMode.HeatCool, 1): ThermoOperation.Cooling,
+    (ThermoMode.Heat, -1): ThermoOperation.Heating,
+    (ThermoMode.HeatCool, -1): ThermoOperation.Heating,
+}
+"""What a thermostat does, by its mode and whether it's above (1) or below (-1) its set points.
+
+Any other combination means it's `ThermoOperation.Off`.
+"""
+
 
-def get_sqlite_engine(db_name: str | None = None) -> Engine:
-    """Return an in-memory SQLite database engine, configured with sensible defaults."""
+def get_sqlite_engine(
+    db_name: str | None = None, poolclass: type[Pool] = StaticPool
+) -> Engine:
+    """Return an in-memory SQLite database engine, configured with sensible defaults.
+
+    By default, every session shares a single connection.
+    With another `poolclass` (e.g., `SingletonThreadPool` or `QueuePool`),
+    connections share one in-memory database through SQLite's shared cache instead,
+    so threads can read concurrently, but writers lock whole tables,
+    and the database is lost if the pool ever closes all its connections.
+    """
+
+    query = {"mode": "memory", "check_same_thread": "false", "uri": "true"}
+    if poolclass is not StaticPool:
+        query["cache"] = "shared"
 
     db_url = engine.URL.create(
         drivername="sqlite",
-        database=db_name or f"file:{uuid.uuid4().int:x}",
-        query={"mode": "memory", "check_same_thread": "false", "uri": "true"},
+        database=db_name or f"file:{secrets.token_hex(16)}",
+        query=query,
     )
 
-    db_engine = create_engine(db_url, poolclass=StaticPool)
+    db_engine = create_engine(db_url, poolclass=poolclass)
 
     # Fix transactional support in the default sqlite driver:
     # - disable BEGIN on connect; emit it at the proper point
     # - disable COMMIT before DDL
     # - enable foreign key support
+    # - keep temporary tables and indices (e.g., used for sorting) in memory
     # See: https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#pysqlite-serializable
+    #
+    # Since the database itself is in-memory, journaling and sync settings have no effect.
     @event.listens_for(db_engine, "connect")
     def on_connect(dbapi_connection, connection_record):  # type: ignore
         dbapi_connection.isolation_level = None
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+        dbapi_connection.executescript("PRAGMA foreign_keys=ON; PRAGMA temp_store=MEMORY;")
 
     @event.listens_for(db_engine, "begin")
     def on_begin(conn):  # type: ignore
@@ -68,6 +112,24 @@ PlaceOrDevice: TypeAlias = Dwelling | Hub | Device
 PlaceOrDeviceT = TypeVar("PlaceOrDeviceT", bound=PlaceOrDevice)
 
 
+_SELECT_BY_NAME: dict[type, Select[Any]] = {}
+
+
+def _select_by_name(kind: type[PlaceOrDeviceT]) -> Select[tuple[PlaceOrDeviceT]]:
+    """Build (once per kind) a query for an item by name, taking `name` as a parameter.
+
+    Device names are only unique per kind, and they're indexed by (kind, name),
+    so queries for a specific kind of device also filter on its discriminator.
+    """
+
+    if (stmt := _SELECT_BY_NAME.get(kind)) is None:
+        stmt = select(kind).where(kind.name == bindparam("name"))
+        if issubclass(kind, Device) and kind is not Device:
+            stmt = stmt.where(kind.kind == kind.__mapper__.polymorphic_identity)
+        _SELECT_BY_NAME[kind] = stmt
+    return stmt
+
+
 class DataStore:
     """A DataStore provides access to DataSessions for DataTransactions."""
 
@@ -97,18 +159,56 @@ class DataSession:
 
     def __init__(self, session: Session) -> None:
         self.session = session
+        self._stale = False
 
     @contextlib.contextmanager
     def transaction(self) -> Iterator[DataTransaction]:
-        self.session.begin()
+        with self._commit_or_rollback(self.session.begin()) as transaction:
+            yield transaction
+
+    @contextlib.contextmanager
+    def savepoint(self) -> Iterator[DataTransaction]:
+        """Like `transaction`, but nested within the current one using a SAVEPOINT.
+
+        If an error occurs, only the work done within the savepoint is rolled back.
+
+        Unlike a commit, releasing a savepoint doesn't expire loaded state,
+        so relationships that aren't kept in sync in memory, like `Dwelling.devices`,
+        may be out of date until `current` reloads them.
+        """
+
+        self._stale = True
+        with self._commit_or_rollback(self.session.begin_nested()) as transaction:
+            yield transaction
+
+    @contextlib.contextmanager
+    def current(self) -> Iterator[DataTransaction]:
+        """Use the transaction already in progress, without a savepoint.
+
+        This is meant for read-only operations: nothing is rolled back if an error occurs.
+        If any savepoints were used since the last read, loaded state is expired first,
+        so reads see their effects, as they would in a new transaction.
+        Expiring here, rather than as each savepoint is released,
+        keeps long runs of writes from reloading everything after every one.
+        """
+
+        if not self.session.in_transaction():
+            raise errors.TrackerError("no transaction in progress")
+        if self._stale:
+            self.session.expire_all()
+            self._stale = False
+        yield DataTransaction(self.session)
+
+    @contextlib.contextmanager
+    def _commit_or_rollback(self, frame: SessionTransaction) -> Iterator[DataTransaction]:
         try:
             yield DataTransaction(self.session)
-            self.session.commit()
+            frame.commit()
         except sqlalchemy.exc.IntegrityError as err:
-            self.session.rollback()
+            frame.rollback()
             raise errors.TrackerError(str(err.orig)) from err
         except:
-            self.session.rollback()
+            frame.rollback()
             raise
 
 
@@ -119,44 +219,111 @@ class DataTransaction:
         self.session = session
 
     def get_all(self, kind: type[PlaceOrDeviceT]) -> Iterator[PlaceOrDeviceT]:
-        """Get all items of a certain kind."""
+        """Get all items of a certain kind.
+
+        Since these are usually for display, deferred display columns are loaded up front,
+        rather than with another query per item.
+        """
 
-        return self.session.scalars(select(kind))
+        stmt = select(kind).options(undefer_group("display"))
+        return self.session.scalars(stmt.execution_options(yield_per=_YIELD_PER))
 
     def get_all_names(self, kind: type[PlaceOrDeviceT]) -> Iterator[str]:
         """Get the names of all items of a certain kind."""
 
-        return self.session.scalars(select(kind.name))
+        return self.session.scalars(select(kind.name).execution_options(yield_per=_YIELD_PER))
 
     def get_by_name(
         self, kind: type[PlaceOrDeviceT], name: str, operation: str = "get"
     ) -> PlaceOrDeviceT:
-        """Find an item by name."""
+        """Find an item by name.
+
+        Items found this way are remembered while the session holds them,
+        so repeated lookups can skip the query as long as the item is still in the session
+        and still has that name (e.g., a rename might have been rolled back).
+        Either way, pending changes are flushed first, so foreign keys like `hub_id` are current
+        and items pending deletion (possibly looked up as another kind) are no longer present.
+        """
+
+        cache = self._name_cache
+        item: PlaceOrDeviceT | None = cache.get((kind, name))
+        if item is not None:
+            self.session.flush()
+            try:
+                if item in self.session and item.name == name:
+                    return item
+            except sqlalchemy.orm.exc.ObjectDeletedError:
+                # Another session deleted it since it was last loaded.
+                self._forget_name(item, name)
 
         try:
-            return self.session.scalars(select(kind).where(kind.name == name)).one()
+            item = self.session.scalars(_select_by_name(kind), {"name": name}).one()
         except sqlalchemy.exc.NoResultFound:
             raise errors.NoResultError(kind.__tablename__, name, operation)
 
+        cache[(kind, name)] = item
+        return item
+
+    @property
+    def _name_cache(self) -> weakref.WeakValueDictionary[tuple[type, str], Any]:
+        cache: weakref.WeakValueDictionary[tuple[type, str], Any]
+        cache = self.session.info.setdefault("name_cache", weakref.WeakValueDictionary())
+        return cache
+
+    def _forget_name(self, item: PlaceOrDevice, name: str) -> None:
+        """Drop `item` from the name cache, under any of the kinds it was looked up as."""
+
+        cache = self._name_cache
+        for kind in type(item).__mro__:
+            if cache.get((kind, name)) is item:
+                del cache[(kind, name)]
+
     def rename(self, kind: type[PlaceOrDevice], old_name: str, new_name: str) -> None:
         """Rename an item."""
 
-        self.get_by_name(kind, old_name, "rename").name = new_name
+        item = self.get_by_name(kind, old_name, "rename")
+        item.name = new_name
+        self._forget_name(item, old_name)
+        self._name_cache[(kind, new_name)] = item
 
     def delete(self, kind: type[PlaceOrDevice], name: str) -> None:
         """Delete an item."""
 
         item = self.get_by_name(kind, name, "delete")
-        if isinstance(item, Device) and item.hub is not None:
-            raise errors.PairedError(item.kind.name, name, "Hub", item.hub.name, "delete")
-        elif isinstance(item, Hub) and item.dwelling is not None:
-            raise errors.PairedError("Hub", name, "Dwelling", item.dwelling.name, "delete")
-        elif isinstance(item, Hub) and len(item.devices) > 0:
-            raise errors.HasDependenciesError("Hub", name, "delete")
-        elif isinstance(item, Dwelling) and len(item.hubs) > 0:
-            raise errors.HasDependenciesError("Dwelling", name, "delete")
+        _DELETE_CHECKS[type(item)](self, item)
 
         self.session.delete(item)
+        self._forget_name(item, name)
+
+    def _check_device_deletable(self, device: Device) -> None:
+        """A `Device` can only be deleted once it's unpaired."""
+
+        if device.hub_id is not None and device.hub is not None:
+            raise errors.PairedError(
+                device.kind.name, device.name, "Hub", device.hub.name, "delete"
+            )
+
+    def _check_hub_deletable(self, hub: Hub) -> None:
+        """A `Hub` can only be deleted once it's uninstalled and has no paired devices."""
+
+        if hub.dwelling_id is not None and hub.dwelling is not None:
+            raise errors.PairedError("Hub", hub.name, "Dwelling", hub.dwelling.name, "delete")
+        if self._exists(select(Device.id).where(Device.hub_id == hub.id)):
+            raise errors.HasDependenciesError("Hub", hub.name, "delete")
+
+    def _check_dwelling_deletable(self, dwelling: Dwelling) -> None:
+        """A `Dwelling` can only be deleted once it has no installed hubs."""
+
+        if self._exists(select(Hub.id).where(Hub.dwelling_id == dwelling.id)):
+            raise errors.HasDependenciesError("Dwelling", dwelling.name, "delete")
+
+    def _exists(self, query: Select[Any]) -> bool:
+        """Whether the `query` has any results, without loading them.
+
+        The `query` should select ORM attributes so that pending changes get flushed first.
+        """
+
+        return bool(self.session.scalar(select(query.exists())))
 
     def install_hub(self, hub_name: str, dwelling_name: str) -> None:
         """Associate a `Hub` with a `Dwelling`."""
@@ -164,7 +331,8 @@ class DataTransaction:
         hub = self.get_by_name(Hub, hub_name, "install hub")
         dwelling = self.get_by_name(Dwelling, dwelling_name, "install hub")
 
-        if hub.dwelling is not None and hub.dwelling_id != dwelling.id:
+        # Compare IDs first; the relationship is only loaded to report an error.
+        if hub.dwelling_id not in (None, dwelling.id) and hub.dwelling is not None:
             raise errors.PairedError(
                 "Hub", hub.name, "Dwelling", hub.dwelling.name, "install hub"
             )
@@ -176,7 +344,7 @@ class DataTransaction:
 
         hub = self.get_by_name(Hub, hub_name, "uninstall hub")
 
-        if hub.dwelling is None:
+        if hub.dwelling_id is None:
             raise errors.UnpairedError("Hub", hub.name, "Dwelling", "uninstall hub")
 
         hub.dwelling = None
@@ -187,7 +355,8 @@ class DataTransaction:
         device = self.get_by_name(kind, device_name, "pair device")
         hub = self.get_by_name(Hub, hub_name, "pair device")
 
-        if device.hub is not None and device.hub_id != hub.id:
+        # Compare IDs first; the relationship is only loaded to report an error.
+        if device.hub_id not in (None, hub.id) and device.hub is not None:
             raise errors.PairedError(
                 device.kind.name, device.name, "Hub", device.hub.name, "pair device"
             )
@@ -199,7 +368,7 @@ class DataTransaction:
 
         device = self.get_by_name(kind, device_name, "unpair device")
 
-        if device.hub is None:
+        if device.hub_id is None:
             raise errors.UnpairedError(device.kind.name, device.name, "Hub", "unpair device")
 
         device.hub = None
@@ -225,6 +394,23 @@ class DataTransaction:
         self.session.add(switch)
         return switch
 
+    def new_many_switches(self, names: Iterable[str]) -> None:
+        """Create a new `Switch` for each of the `names`, using a single bulk INSERT.
+
+        Unlike `new_switch`, this doesn't construct the objects in Python,
+        so it's better suited to creating many switches at once.
+        """
+
+        now = datetime.now()
+        timestamps = {"firmware_updated": now, "created_at": now, "updated_at": now}
+        rows = [{"name": name, **timestamps} for name in names]
+
+        # With no rows, SQLAlchemy would insert a single row of defaults instead.
+        if not rows:
+            return
+
+        self.session.execute(insert(Switch), rows)
+
     def new_dimmer(self, name: str, min_value: int, max_value: int, scale: int) -> Dimmer:
         """Create a new `Dimmer`."""
 
@@ -252,26 +438,22 @@ class DataTransaction:
         """Change the range or scale of an existing `Dimmer`."""
 
         dimmer = self.get_by_name(Dimmer, name, "update range")
-        dimmer.value = min_value
-        dimmer.min_value = min_value
-        dimmer.max_value = max_value
-        dimmer.scale = scale
+        _assign(dimmer, value=min_value, min_value=min_value, max_value=max_value, scale=scale)
 
     def update_thermostat(self, name: str, display: ThermoDisplay) -> None:
         """Change the display mode for a `Thermostat`."""
 
-        self.get_by_name(Thermostat, name, "update mode").display = display
+        _assign(self.get_by_name(Thermostat, name, "update mode"), display=display)
 
     def set_dwelling_occupancy(self, name: str, state: OccupancyState) -> None:
         """Change the occupancy state of a `Dwelling`."""
 
-        self.get_by_name(Dwelling, name, "set occupancy").occupancy = state
+        _assign(self.get_by_name(Dwelling, name, "set occupancy"), occupancy=state)
 
     def set_switch_state(self, name: str, state: SwitchState) -> None:
         """Set a `Switch`'s state."""
 
-        switch = self.get_by_name(Switch, name, "set state")
-        switch.state = state
+        _assign(self.get_by_name(Switch, name, "set state"), state=state)
 
     def set_dimmer_value(self, name: str, value: int) -> None:
         """Set a `Dimmer`'s value."""
@@ -282,7 +464,7 @@ class DataTransaction:
                 "Dimmer", name, value, dimmer.min_value, dimmer.max_value, "set"
             )
 
-        dimmer.value = value
+        _assign(dimmer, value=value)
 
     def _change_thermo_state(self, thermo: Thermostat) -> None:
         """Check and, if necessary, change the `Thermostat`'s mode to reach the target temperature."""
@@ -290,24 +472,16 @@ class DataTransaction:
         if thermo.mode is ThermoMode.Off:
             return
 
-        if thermo.current_centi_c > thermo.high_centi_c and thermo.mode in (
-            ThermoMode.Cool,
-            ThermoMode.HeatCool,
-        ):
-            thermo.state = ThermoOperation.Cooling
-        elif thermo.current_centi_c < thermo.low_centi_c and thermo.mode in (
-            ThermoMode.Heat,
-            ThermoMode.HeatCool,
-        ):
-            thermo.state = ThermoOperation.Heating
-        else:
-            thermo.state = ThermoOperation.Off
+        current = thermo.current_centi_c
+        direction = (current > thermo.high_centi_c) - (current < thermo.low_centi_c)
+        state = _THERMO_OPERATIONS.get((thermo.mode, direction), ThermoOperation.Off)
+        _assign(thermo, state=state)
 
     def set_thermo_mode(self, name: str, mode: ThermoMode) -> None:
         """Set a `Thermostat`'s operation mode."""
 
         thermo = self.get_by_name(Thermostat, name, "set mode")
-        thermo.mode = mode
+        _assign(thermo, mode=mode)
         self._change_thermo_state(thermo)
 
     def set_thermo_current_temp(self, name: str, value: CentiCelsius) -> None:
@@ -318,43 +492,74 @@ class DataTransaction:
         """
 
         thermo = self.get_by_name(Thermostat, name, "set current temperature")
-        thermo.current_centi_c = value
+        _assign(thermo, current_centi_c=value)
         self._change_thermo_state(thermo)
 
     def set_thermo_set_points(self, name: str, low: CentiCelsius, high: CentiCelsius) -> None:
         """Set a `Thermostat`'s low and high set points."""
 
         thermo = self.get_by_name(Thermostat, name, "set temperature")
-        thermo.low_centi_c = low
-        thermo.high_centi_c = high
+        _assign(thermo, low_centi_c=low, high_centi_c=high)
         self._change_thermo_state(thermo)
 
-    def lock_door(self, name: str) -> None:
-        """Set a `Lock` to locked."""
+    def lock_door(self, name: str) -> LockState:
+        """Set a `Lock` to locked, and return its new state."""
 
-        self.get_by_name(Lock, name, "lock").state = LockState.Locked
+        lock = self.get_by_name(Lock, name, "lock")
+        _assign(lock, state=LockState.Locked)
+        return lock.state
 
-    def unlock_door(self, name: str, pin: str) -> None:
-        """Attempt to unlock a `Lock`, if the `pin` is correct ."""
+    def unlock_door(self, name: str, pin: str) -> LockState:
+        """Attempt to unlock a `Lock`, if the `pin` is correct, and return its new state."""
 
         lock = self.get_by_name(Lock, name, "lock")
-        if pin not in lock.pin_codes:
+        if not self._exists(
+            select(LockPin.pin).where(LockPin.lock_id == lock.id, LockPin.pin == pin)
+        ):
             raise errors.InvalidPinError()
 
-        lock.state = LockState.Unlocked
+        _assign(lock, state=LockState.Unlocked)
+        return lock.state
 
     def add_lock_pin(self, name: str, pin: str) -> None:
         """Add a new `pin` to a `Lock`. Does nothing if it is already present."""
 
+        # Insert the pin directly, rather than loading the lock's pins to check for it.
         lock = self.get_by_name(Lock, name, "lock")
-        if pin not in lock.pin_codes:
-            lock.pin_codes.append(pin)
+        self.session.execute(
+            sqlite.insert(LockPin).values(lock_id=lock.id, pin=pin).on_conflict_do_nothing()
+        )
+        self.session.expire(lock, ["lock_pins"])
 
     def remove_lock_pin(self, name: str, pin: str) -> None:
         """Remove a `pin` from a `Lock`."""
 
-        lock = self.get_by_name(Lock, name, "lock")
-        if pin not in lock.pin_codes:
+        pin_codes = self.get_by_name(Lock, name, "lock").pin_codes
+        try:
+            pin_codes.remove(pin)
+        except ValueError:
             raise errors.InvalidPinError()
 
-        lock.pin_codes.remove(pin)
+
+def _assign(item: BaseModel, **values: Any) -> None:
+    """Set attributes of the `item`, skipping those that already have the given value.
+
+    Assigning an equal value doesn't cause an UPDATE,
+    but it does mark the item dirty, so the next flush has to inspect it.
+    """
+
+    for attr, value in values.items():
+        if getattr(item, attr) != value:
+            setattr(item, attr, value)
+
+
+_DELETE_CHECKS: dict[type, Callable[[DataTransaction, Any], None]] = {
+    Dwelling: DataTransaction._check_dwelling_deletable,
+    Hub: DataTransaction._check_hub_deletable,
+    Device: DataTransaction._check_device_deletable,
+    Switch: DataTransaction._check_device_deletable,
+    Dimmer: DataTransaction._check_device_deletable,
+    Lock: DataTransaction._check_device_deletable,
+    Thermostat: DataTransaction._check_device_deletable,
+}
+"""How `DataTransaction.delete` checks that an item can be deleted, by its exact type."""
@@ -2,17 +2,33 @@
 This module declares errors used in the package.
 """
 
+import abc
+
 
 class TrackerError(Exception):
     """Base Error class for errors in this package."""
 
 
-class OperationError(TrackerError):
-    """Errors encounter while attempting a specific operation."""
+class OperationError(TrackerError, metaclass=abc.ABCMeta):
+    """Errors encounter while attempting a specific operation.
+
+    The message is only formatted if it's needed, i.e., when the error is converted to a string.
+    Subclasses describe why the operation failed by implementing `reason`,
+    and pass the values it uses as `fields`, which become the error's `args`,
+    followed by the `operation`, in the same order as their own parameters.
+    """
 
-    def __init__(self, operation: str, reason: str):
+    def __init__(self, operation: str, *fields: object):
         self.operation = operation
-        super().__init__(f"unable to complete {operation} because {reason}")
+        super().__init__(*fields, operation)
+
+    def __str__(self) -> str:
+        return f"unable to complete {self.operation} because {self.reason}"
+
+    @property
+    @abc.abstractmethod
+    def reason(self) -> str:
+        """Why the operation failed."""
 
 
 class NoResultError(OperationError):
@@ -21,7 +37,12 @@ class NoResultError(OperationError):
     def __init__(self, kind: str, name: str, operation: str):
         self.kind = kind
         self.name = name
-        super().__init__(operation, f"no item matches {kind=} and {name=}")
+        super().__init__(operation, kind, name)
+
+    @property
+    def reason(self) -> str:
+        kind, name = self.kind, self.name
+        return f"no item matches {kind=} and {name=}"
 
 
 class PairedError(OperationError):
@@ -32,9 +53,11 @@ class PairedError(OperationError):
         self.name = name
         self.pair_kind = pair_kind
         self.pair_name = pair_name
-        super().__init__(
-            operation, f"{kind} '{name}' is paired with {pair_kind} '{pair_name}'"
-        )
+        super().__init__(operation, kind, name, pair_kind, pair_name)
+
+    @property
+    def reason(self) -> str:
+        return f"{self.kind} '{self.name}' is paired with {self.pair_kind} '{self.pair_name}'"
 
 
 class UnpairedError(OperationError):
@@ -44,7 +67,11 @@ class UnpairedError(OperationError):
         self.kind = kind
         self.name = name
         self.pair_kind = pair_kind
-        super().__init__(operation, f"{kind} '{name}' is not paired with a {pair_kind}")
+        super().__init__(operation, kind, name, pair_kind)
+
+    @property
+    def reason(self) -> str:
+        return f"{self.kind} '{self.name}' is not paired with a {self.pair_kind}"
 
 
 class HasDependenciesError(OperationError):
@@ -53,14 +80,22 @@ class HasDependenciesError(OperationError):
     def __init__(self, kind: str, name: str, operation: str):
         self.kind = kind
         self.name = name
-        super().__init__(operation, f"{kind} '{name}' has dependencies")
+        super().__init__(operation, kind, name)
+
+    @property
+    def reason(self) -> str:
+        return f"{self.kind} '{self.name}' has dependencies"
 
 
 class InvalidPinError(OperationError):
     """Raised if there's an attempt to unlock a door using an invalid pin."""
 
     def __init__(self, operation: str = "unlock door"):
-        super().__init__(operation, "the pin is invalid")
+        super().__init__(operation)
+
+    @property
+    def reason(self) -> str:
+        return "the pin is invalid"
 
 
 class OutOfRangeError(OperationError):
@@ -80,8 +115,12 @@ class OutOfRangeError(OperationError):
         self.target_value = target_value
         self.min_value = min_value
         self.max_value = max_value
-        super().__init__(
-            operation,
-            f"{target_value=} is not in range [{min_value}, {max_value}] "
-            f"for {kind} '{name}'",
+        super().__init__(operation, kind, name, target_value, min_value, max_value)
+
+    @property
+    def reason(self) -> str:
+        target_value = self.target_value
+        return (
+            f"{target_value=} is not in range [{self.min_value}, {self.max_value}] "
+            f"for {self.kind} '{self.name}'"
         )
@@ -6,19 +6,29 @@ from typing import Iterator
 
 import pytest
 import sqlalchemy
+from sqlalchemy.orm import Session
 
 from tracker import datastore
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def db_engine() -> sqlalchemy.Engine:
     return datastore.get_sqlite_engine()
 
 
 @pytest.fixture
 def session(db_engine: sqlalchemy.Engine) -> Iterator[datastore.DataSession]:
-    with datastore.DataStore(db_engine).session() as session:
-        yield session
+    """Run each test inside an outer transaction which is rolled back afterwards.
+
+    The session joins that transaction using SAVEPOINTs,
+    so the tests' own commits and rollbacks still behave normally,
+    but nothing they write outlives the test.
+    """
+
+    with db_engine.connect() as conn, conn.begin() as outer:
+        with Session(bind=conn, join_transaction_mode="create_savepoint") as session:
+            yield datastore.DataSession(session)
+        outer.rollback()
 
 
 @pytest.fixture
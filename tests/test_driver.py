@@ -0,0 +1,59 @@
+"""
+Tests for the example driver script, run as if its commands were piped in.
+"""
+
+import io
+
+import pytest
+
+import driver
+
+
+def run(script: str) -> str:
+    output = io.StringIO()
+    driver.main(io.StringIO(script), output)
+    return output.getvalue()
+
+
+def test_batch_sees_earlier_commands() -> None:
+    output = run(
+        """
+        NEW DWELLING home
+        NEW HUB hub
+        INSTALL hub INTO home
+        NEW SWITCH s1
+        PAIR SWITCH s1 WITH hub
+        SHOW DWELLING home
+        UNPAIR SWITCH s1
+        DELETE SWITCH s1
+        SHOW DWELLING home
+        """
+    )
+
+    paired, deleted = output.split("--DWELLING 'home'--")[1:]
+    assert "devices=[...]" in paired
+    assert "devices=[]" in deleted
+
+
+def test_bad_syntax_before_bad_number(caplog: pytest.LogCaptureFixture) -> None:
+    run("SET THERMOSTAT t TARGET TO warm FROM 30")
+    assert "unknown command or bad syntax" in caplog.text
+
+
+def test_batch_detail_all_after_write() -> None:
+    output = run(
+        """
+        NEW DWELLING home
+        NEW HUB hub
+        INSTALL hub INTO home
+        NEW SWITCH s1
+        PAIR SWITCH s1 WITH hub
+        DETAIL DWELLINGS
+        UNPAIR SWITCH s1
+        DETAIL DWELLINGS
+        """
+    )
+
+    paired, unpaired = output.split("--All DWELLINGS--")[1:]
+    assert "name='s1'" in paired
+    assert "name='s1'" not in unpaired
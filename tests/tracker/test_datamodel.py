@@ -7,14 +7,23 @@ meant really only to demonstrate
 A real test suite would include better properties-based testing and fuzzing.
 """
 
+import functools
 import random
 import string
+from typing import Callable
 
 import pytest
+import sqlalchemy
 
 from tracker import datamodel as dm
 from tracker import errors
-from tracker.datastore import DataSession
+from tracker.datastore import (
+    DataSession,
+    DataStore,
+    DataTransaction,
+    PlaceOrDevice,
+    get_sqlite_engine,
+)
 
 
 @pytest.fixture
@@ -23,13 +32,20 @@ def rng() -> random.Random:
 
 
 class NameGen:
+    charset = string.digits + string.ascii_letters
+
     def __init__(self, rng: random.Random):
         self.rng = rng
 
     def __call__(self, min_len: int = 5, max_len: int = 20, charset: str | None = None) -> str:
-        if not charset:
-            charset = string.digits + string.ascii_letters
-        return "".join(self.rng.choices(charset, k=self.rng.randint(min_len, max_len)))
+        raw = self.rng.randbytes(self.rng.randint(min_len, max_len))
+        return raw.translate(self._table(charset or self.charset)).decode()
+
+    @staticmethod
+    @functools.cache
+    def _table(charset: str) -> bytes:
+        """Map every byte onto the (ASCII) `charset`, for use with `bytes.translate`."""
+        return bytes(ord(charset[b % len(charset)]) for b in range(256))
 
 
 @pytest.fixture
@@ -37,155 +53,207 @@ def name_gen(rng: random.Random) -> NameGen:
     return NameGen(rng)
 
 
+# How to create each kind of item, given a transaction and a name.
+_FACTORIES: dict[type[PlaceOrDevice], Callable[[DataTransaction, str], PlaceOrDevice]] = {
+    dm.Dwelling: lambda t, n: t.new_dwelling(n),
+    dm.Hub: lambda t, n: t.new_hub(n),
+    dm.Switch: lambda t, n: t.new_switch(n),
+    dm.Dimmer: lambda t, n: t.new_dimmer(n, 0, 100, 1),
+    dm.Lock: lambda t, n: t.new_lock(n, "12345"),
+    dm.Thermostat: lambda t, n: t.new_thermostat(n, dm.ThermoDisplay.Celsius),
+}
+
+
 class TestDatastore:
-    def test_dwelling(self, session: DataSession, name_gen: NameGen) -> None:
+    @pytest.mark.parametrize(
+        "model,factory", _FACTORIES.items(), ids=[m.__name__.lower() for m in _FACTORIES]
+    )
+    def test_crud(
+        self,
+        session: DataSession,
+        name_gen: NameGen,
+        model: type[PlaceOrDevice],
+        factory: Callable[[DataTransaction, str], PlaceOrDevice],
+    ) -> None:
         name = name_gen()
 
         with session.transaction() as t:
-            result = t.new_dwelling(name)
+            result = factory(t, name)
 
         with session.transaction() as t:
-            assert t.get_by_name(dm.Dwelling, name) == result
-
-        with session.transaction() as t:
-            t.delete(dm.Dwelling, name)
+            assert t.get_by_name(model, name) == result
+            t.delete(model, name)
 
         with session.transaction() as t:
             with pytest.raises(errors.NoResultError):
-                t.get_by_name(dm.Dwelling, name)
+                t.get_by_name(model, name)
 
-    def test_hub(self, session: DataSession, name_gen: NameGen) -> None:
+    def test_same_names(self, session: DataSession, name_gen: NameGen) -> None:
         name = name_gen()
 
         with session.transaction() as t:
-            result = t.new_hub(name)
+            created = {model: factory(t, name) for model, factory in _FACTORIES.items()}
 
         with session.transaction() as t:
-            assert t.get_by_name(dm.Hub, name) == result
+            for model, item in created.items():
+                assert t.get_by_name(model, name) == item
 
-        with session.transaction() as t:
-            t.delete(dm.Hub, name)
+    def test_associations(self, session: DataSession, name_gen: NameGen) -> None:
+        dwelling_name = name_gen()
+        hub_name = name_gen()
+        switch_name = name_gen()
 
         with session.transaction() as t:
-            with pytest.raises(errors.NoResultError):
-                t.get_by_name(dm.Hub, name)
-
-    def test_switch(self, session: DataSession, name_gen: NameGen) -> None:
-        name = name_gen()
+            t.new_dwelling(dwelling_name)
+            t.new_hub(hub_name)
+            t.new_switch(switch_name)
+            t.install_hub(hub_name, dwelling_name)
+            t.pair_device(dm.Switch, switch_name, hub_name)
 
-        with session.transaction() as t:
-            result = t.new_switch(name)
+            dwelling = t.get_by_name(dm.Dwelling, dwelling_name)
+            hub = t.get_by_name(dm.Hub, hub_name)
+            switch = t.get_by_name(dm.Switch, switch_name)
+            assert list(hub.devices) == [switch]
+            assert list(dwelling.hubs) == [hub]
 
-        with session.transaction() as t:
-            assert t.get_by_name(dm.Switch, name) == result
+            with pytest.raises(errors.HasDependenciesError), session.savepoint() as sp:
+                sp.delete(dm.Dwelling, dwelling_name)
+            with pytest.raises(errors.PairedError), session.savepoint() as sp:
+                sp.delete(dm.Hub, hub_name)
 
-        with session.transaction() as t:
-            t.delete(dm.Switch, name)
+            t.uninstall_hub(hub_name)
+            t.delete(dm.Dwelling, dwelling_name)
 
-        with session.transaction() as t:
-            with pytest.raises(errors.NoResultError):
-                t.get_by_name(dm.Switch, name)
+            with pytest.raises(errors.HasDependenciesError), session.savepoint() as sp:
+                sp.delete(dm.Hub, hub_name)
+            with pytest.raises(errors.PairedError), session.savepoint() as sp:
+                sp.delete(dm.Switch, switch_name)
 
-    def test_dimmer(self, session: DataSession, name_gen: NameGen) -> None:
-        name = name_gen()
+            t.unpair_device(dm.Switch, switch_name)
+            t.delete(dm.Switch, switch_name)
+            t.delete(dm.Hub, hub_name)
 
-        with session.transaction() as t:
-            result = t.new_dimmer(name, 0, 100, 1)
+            assert list(t.get_all(dm.Dwelling)) == []
 
-        with session.transaction() as t:
-            assert t.get_by_name(dm.Dimmer, name) == result
+    def test_install_twice(self, session: DataSession, name_gen: NameGen) -> None:
+        first, second, hub = name_gen(), name_gen(), name_gen()
 
         with session.transaction() as t:
-            t.delete(dm.Dimmer, name)
+            t.new_dwelling(first)
+            t.new_dwelling(second)
+            t.new_hub(hub)
 
         with session.transaction() as t:
-            with pytest.raises(errors.NoResultError):
-                t.get_by_name(dm.Dimmer, name)
+            t.install_hub(hub, first)
+            t.uninstall_hub(hub)
+            t.install_hub(hub, first)
+            with pytest.raises(errors.PairedError):
+                t.install_hub(hub, second)
 
-    def test_lock(self, session: DataSession, name_gen: NameGen) -> None:
+    def test_pooled_engine(self, name_gen: NameGen) -> None:
+        db_engine = get_sqlite_engine(poolclass=sqlalchemy.QueuePool)
         name = name_gen()
 
-        with session.transaction() as t:
-            result = t.new_lock(name, "12345")
+        try:
+            with db_engine.connect() as other:
+                with DataStore(db_engine).session() as session:
+                    with session.transaction() as t:
+                        t.new_dwelling(name)
 
-        with session.transaction() as t:
-            assert t.get_by_name(dm.Lock, name) == result
+                names = other.execute(sqlalchemy.select(dm.Dwelling.name)).scalars().all()
+                assert names == [name]
+        finally:
+            # The shared-cache database lives until its last connection closes.
+            db_engine.dispose()
 
-        with session.transaction() as t:
-            t.delete(dm.Lock, name)
+    def test_savepoint(self, session: DataSession, name_gen: NameGen) -> None:
+        kept = name_gen()
+        dropped = name_gen()
 
         with session.transaction() as t:
-            with pytest.raises(errors.NoResultError):
-                t.get_by_name(dm.Lock, name)
-
-    def test_thermostat(self, session: DataSession, name_gen: NameGen) -> None:
-        name = name_gen()
+            t.new_dwelling(kept)
+            with pytest.raises(errors.TrackerError):
+                with session.savepoint() as sp:
+                    sp.new_dwelling(dropped)
+                    sp.new_dwelling(kept)
 
         with session.transaction() as t:
-            result = t.new_thermostat(name, dm.ThermoDisplay.Celsius)
+            assert list(t.get_all_names(dm.Dwelling)) == [kept]
 
-        with session.transaction() as t:
-            assert t.get_by_name(dm.Thermostat, name) == result
+    def test_name_cache_rollback(self, session: DataSession, name_gen: NameGen) -> None:
+        old_name = name_gen()
+        new_name = name_gen()
 
         with session.transaction() as t:
-            t.delete(dm.Thermostat, name)
+            dwelling = t.new_dwelling(old_name)
+            assert t.get_by_name(dm.Dwelling, old_name) is dwelling
+            with pytest.raises(errors.TrackerError):
+                with session.savepoint() as sp:
+                    sp.rename(dm.Dwelling, old_name, new_name)
+                    assert sp.get_by_name(dm.Dwelling, new_name) is dwelling
+                    raise errors.TrackerError("roll back")
 
         with session.transaction() as t:
+            assert t.get_by_name(dm.Dwelling, old_name) is dwelling
             with pytest.raises(errors.NoResultError):
-                t.get_by_name(dm.Thermostat, name)
+                t.get_by_name(dm.Dwelling, new_name)
 
-    def test_same_names(self, session: DataSession, name_gen: NameGen) -> None:
+            t.delete(dm.Dwelling, old_name)
+            with pytest.raises(errors.NoResultError):
+                t.get_by_name(dm.Dwelling, old_name)
+
+    @pytest.mark.parametrize(
+        "lookup,deleted", [(dm.Switch, dm.Device), (dm.Device, dm.Switch)], ids=["sub", "base"]
+    )
+    def test_name_cache_delete(
+        self,
+        session: DataSession,
+        name_gen: NameGen,
+        lookup: type[dm.Device],
+        deleted: type[dm.Device],
+    ) -> None:
         name = name_gen()
 
         with session.transaction() as t:
-            switch = t.new_switch(name)
-            dimmer = t.new_dimmer(name, 0, 100, 1)
-            lock = t.new_lock(name, "1234")
-            therm = t.new_thermostat(name, dm.ThermoDisplay.Celsius)
+            t.new_switch(name)
 
         with session.transaction() as t:
-            assert t.get_by_name(dm.Switch, name) == switch
-            assert t.get_by_name(dm.Dimmer, name) == dimmer
-            assert t.get_by_name(dm.Lock, name) == lock
-            assert t.get_by_name(dm.Thermostat, name) == therm
-
-    def test_associations(self, session: DataSession, name_gen: NameGen) -> None:
-        dwelling_name = name_gen()
-        hub_name = name_gen()
-        switch_name = name_gen()
+            t.get_by_name(lookup, name)
+            t.delete(deleted, name)
+            with pytest.raises(errors.NoResultError):
+                t.get_by_name(lookup, name)
 
-        with session.transaction() as t:
-            t.new_dwelling(dwelling_name)
-            t.new_hub(hub_name)
-            t.new_switch(switch_name)
-            t.install_hub(hub_name, dwelling_name)
-            t.pair_device(dm.Switch, switch_name, hub_name)
+    def test_name_cache_other_session(self, name_gen: NameGen) -> None:
+        db_engine = get_sqlite_engine(poolclass=sqlalchemy.QueuePool)
+        store = DataStore(db_engine)
+        name = name_gen()
 
-        with session.transaction() as t:
-            dwelling = t.get_by_name(dm.Dwelling, dwelling_name)
-            hub = t.get_by_name(dm.Hub, hub_name)
-            switch = t.get_by_name(dm.Switch, switch_name)
-            assert list(hub.devices) == [switch]
-            assert list(dwelling.hubs) == [hub]
+        try:
+            with store.session() as ours, store.session() as theirs:
+                with ours.transaction() as t:
+                    dwelling = t.new_dwelling(name)
+                    assert t.get_by_name(dm.Dwelling, name) is dwelling
 
-            with pytest.raises(errors.HasDependenciesError):
-                t.delete(dm.Dwelling, dwelling_name)
-            with pytest.raises(errors.PairedError):
-                t.delete(dm.Hub, hub_name)
+                with theirs.transaction() as t:
+                    t.delete(dm.Dwelling, name)
 
-            t.uninstall_hub(hub_name)
-            t.delete(dm.Dwelling, dwelling_name)
+                with ours.transaction() as t:
+                    with pytest.raises(errors.NoResultError):
+                        t.get_by_name(dm.Dwelling, name)
+        finally:
+            db_engine.dispose()
 
-            with pytest.raises(errors.HasDependenciesError):
-                t.delete(dm.Hub, hub_name)
-            with pytest.raises(errors.PairedError):
-                t.delete(dm.Switch, switch_name)
+    def test_current(self, session: DataSession, name_gen: NameGen) -> None:
+        name = name_gen()
 
-            t.unpair_device(dm.Switch, switch_name)
-            t.delete(dm.Switch, switch_name)
-            t.delete(dm.Hub, hub_name)
+        with pytest.raises(errors.TrackerError):
+            with session.current():
+                pass
 
-            assert list(t.get_all(dm.Dwelling)) == []
+        with session.transaction() as t:
+            t.new_dwelling(name)
+            with session.current() as c:
+                assert c.get_by_name(dm.Dwelling, name).name == name
 
 
 class TestDwelling:
@@ -231,6 +299,22 @@ class TestSwitch:
             s = t.get_by_name(dm.Switch, switch.name)
             assert s.state is state
 
+    def test_new_many(self, session: DataSession, name_gen: NameGen) -> None:
+        names = sorted({name_gen() for _ in range(10)})
+
+        with session.transaction() as t:
+            t.new_many_switches(names)
+
+        with session.transaction() as t:
+            assert sorted(t.get_all_names(dm.Switch)) == names
+            s = t.get_by_name(dm.Switch, names[0])
+            assert s.kind is dm.DeviceKind.Switch
+            assert s.state is dm.SwitchState.Off
+
+        with session.transaction() as t:
+            t.new_many_switches([])
+            assert sorted(t.get_all_names(dm.Switch)) == names
+
 
 class TestDimmer:
     minv = 0
@@ -276,14 +360,20 @@ class TestDimmer:
             with session.transaction() as t:
                 t.update_dimmer(dimmer.name, mn, mx, s)
 
-    @pytest.mark.parametrize("value", range(minv, maxv))
-    def test_set_value(self, session: DataSession, dimmer: dm.Dimmer, value: int) -> None:
+    def test_set_values(self, session: DataSession, dimmer: dm.Dimmer) -> None:
+        # Every in-range value takes the same path, so check the boundaries and one in between,
+        # ending on one that differs from the initial value, so it's visible that it persisted.
+        minv, maxv = TestDimmer.minv, TestDimmer.maxv
+        values = [minv + 1, (minv + maxv) // 2, maxv - 1, minv, maxv]
+
         with session.transaction() as t:
-            t.set_dimmer_value(dimmer.name, value)
+            for value in values:
+                t.set_dimmer_value(dimmer.name, value)
+                assert dimmer.value == value
 
         with session.transaction() as t:
             d = t.get_by_name(dm.Dimmer, dimmer.name)
-            assert d.value == value
+            assert d.value == values[-1]
 
     @pytest.mark.parametrize("value", [-10, -1, 101, 500])
     def test_invalid(self, session: DataSession, dimmer: dm.Dimmer, value: int) -> None:
@@ -294,26 +384,22 @@ class TestDimmer:
 
 class TestLock:
     pin = "12345"
+    new_pins = ["1234", "0123", "0000", "0" * 100]
 
     @pytest.fixture
     def lock(self, session: DataSession, name_gen: NameGen) -> dm.Lock:
         with session.transaction() as t:
             return t.new_lock(name_gen(), TestLock.pin)
 
-    @pytest.mark.parametrize("pin", ["1234", "0123", "0000", "0" * 100])
+    @pytest.mark.parametrize("pin", new_pins)
     def test_bad_pin(self, session: DataSession, lock: dm.Lock, pin: str) -> None:
         with session.transaction() as t:
-            t.lock_door(lock.name)
-
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Locked
+            assert t.lock_door(lock.name) is dm.LockState.Locked
             with pytest.raises(errors.InvalidPinError):
                 t.unlock_door(lock.name, pin)
 
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Locked
+        with session.transaction():
+            assert lock.state is dm.LockState.Locked
 
     @pytest.mark.parametrize("pin", ["", "012", "asdf"])
     def test_add_bad(self, session: DataSession, lock: dm.Lock, pin: str) -> None:
@@ -321,53 +407,31 @@ class TestLock:
             with session.transaction() as t:
                 t.add_lock_pin(lock.name, pin)
 
-    @pytest.mark.parametrize("pin", ["1234", "0123", "0000", "0" * 100])
+    @pytest.mark.parametrize("pin", new_pins)
     def test_add_remove(self, session: DataSession, lock: dm.Lock, pin: str) -> None:
         with session.transaction() as t:
             t.add_lock_pin(lock.name, pin)
-            t.lock_door(lock.name)
+            assert t.lock_door(lock.name) is dm.LockState.Locked
+            assert t.unlock_door(lock.name, pin) is dm.LockState.Unlocked
 
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Locked
-            t.unlock_door(lock.name, pin)
-
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Unlocked
+            # The original pin still works.
             t.lock_door(lock.name)
-
-        # The original pin still works.
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Locked
-            t.unlock_door(lock.name, TestLock.pin)
-
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Unlocked
+            assert t.unlock_door(lock.name, TestLock.pin) is dm.LockState.Unlocked
 
         # Remove the added pin and verify we can't use it any longer.
         with session.transaction() as t:
             t.remove_lock_pin(lock.name, pin)
-            t.lock_door(lock.name)
-            assert lock.state is dm.LockState.Locked
-
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Locked
+            assert t.lock_door(lock.name) is dm.LockState.Locked
             with pytest.raises(errors.InvalidPinError):
                 t.unlock_door(lock.name, pin)
 
-        # But the original pin still works even still.
-        with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Locked
-            t.unlock_door(lock.name, TestLock.pin)
+            # But the original pin still works even still.
+            assert t.unlock_door(lock.name, TestLock.pin) is dm.LockState.Unlocked
 
         with session.transaction() as t:
-            l = t.get_by_name(dm.Lock, lock.name)
-            assert l.state is dm.LockState.Unlocked
+            assert lock.state is dm.LockState.Unlocked
+            with pytest.raises(errors.InvalidPinError):
+                t.unlock_door(lock.name, pin)
 
 
 class TestThermostat: